@@ -1,6 +1,12 @@
 import os
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import logging
+from utils import cache_path, remove_stale_caches
 
 # Set up logging
 logging.basicConfig(
@@ -9,18 +15,73 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+# Cleaned output, written back into the data directory; it is not a source file
+OUTPUT_FILE = "cleaned_stock_data.csv"
+
+# Arrow types of the raw CSV columns (names as they appear before cleaning)
+COLUMN_TYPES = {
+    '<Ticker>': pa.string(),
+    '<DTYYYYMMDD>': pa.int32(),
+    '<Open>': pa.float32(),
+    '<High>': pa.float32(),
+    '<Low>': pa.float32(),
+    '<Close>': pa.float32(),
+    '<Volume>': pa.int64(),
+}
+
+# Translation table deleting '<' and '>' in a single pass
+_ANGLE_BRACKETS = str.maketrans('', '', '<>')
+
 # Function to clean column names
-def clean_column_names(df):
+def clean_column_names(table):
     """
     Clean column names by removing '<' and '>' characters.
     Args:
-        df (pd.DataFrame): DataFrame with columns to be cleaned.
+        table (pa.Table): Arrow table with columns to be cleaned.
     Returns:
-        pd.DataFrame: DataFrame with cleaned column names.
+        pa.Table: Arrow table with cleaned column names.
     """
-    df.columns = df.columns.str.replace('<', '').str.replace('>', '')
-    logging.info(f"Cleaned column names: {df.columns}")
-    return df
+    table = table.rename_columns([c.translate(_ANGLE_BRACKETS) for c in table.column_names])
+    logging.info("Cleaned column names: %s", table.column_names)
+    return table
+
+def read_file(file):
+    """
+    Read the critical columns of one CSV file and clean their names.
+    Args:
+        file (str): Path to the CSV file.
+    Returns:
+        pa.Table: Arrow table with cleaned column names.
+    Raises:
+        ValueError: If a critical column is missing from the file.
+    """
+    # Read data from CSV with comma delimiter. Only the critical columns are parsed,
+    # with fixed types so no type inference runs. Files are already read in parallel,
+    # so each read stays on its own thread.
+    try:
+        table = pacsv.read_csv(
+            file,
+            read_options=pacsv.ReadOptions(use_threads=False),
+            parse_options=pacsv.ParseOptions(delimiter=','),  # You can change the delimiter if needed (e.g., ';')
+            convert_options=pacsv.ConvertOptions(
+                column_types=COLUMN_TYPES,
+                include_columns=list(COLUMN_TYPES),
+                # Blank cells (quoted or not) are missing values, as pd.read_csv reads them
+                strings_can_be_null=True,
+                quoted_strings_can_be_null=True
+            )
+        )
+    except pa.ArrowKeyError as e:
+        # A critical column is not in the file
+        logging.error(f"Missing columns in file {file}: {e}")
+        raise ValueError(f"Missing columns in file: {file}. {e}")
+
+    # Remove extra whitespace from column names and clean column names
+    table = clean_column_names(table)
+
+    # Log the columns in the CSV file
+    logging.info("Columns in file %s: %s", file, table.column_names)
+    return table
 
 def load_data(data_dir):
     """
@@ -31,36 +92,40 @@ def load_data(data_dir):
         pd.DataFrame: Combined DataFrame with all stock data.
     """
     try:
-        # Get all CSV files in the directory
-        all_files = [os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.endswith('.csv')]
-        data_frames = []
+        # Get all CSV files in the directory, in a deterministic order
+        with os.scandir(data_dir) as entries:
+            all_files = sorted(
+                e.path for e in entries if e.is_file() and e.name.endswith('.csv') and e.name != OUTPUT_FILE
+            )
+        critical_columns = ['Ticker', 'DTYYYYMMDD', 'Open', 'High', 'Low', 'Close', 'Volume']
+        columns = defaultdict(list)
 
         if not all_files:
             raise ValueError("No CSV files found in the directory.")
 
-        for file in all_files:
-            # Read data from CSV with comma delimiter
-            df = pd.read_csv(file, delimiter=',')  # You can change the delimiter if needed (e.g., ';')
-            
-            # Remove extra whitespace from column names and clean column names
-            df = clean_column_names(df)
-
-            # Log the columns in the CSV file
-            logging.info(f"Columns in file {file}: {df.columns}")
-            
-            # Check if necessary columns are in the data
-            critical_columns = ['Ticker', 'DTYYYYMMDD', 'Open', 'High', 'Low', 'Close', 'Volume']
-            missing_columns = [col for col in critical_columns if col not in df.columns]
-            if missing_columns:
-                logging.error(f"Missing columns: {missing_columns} in file {file}")
-                raise ValueError(f"Missing columns in file: {file}. Missing columns: {missing_columns}")
-
-            data_frames.append(df)
-            logging.info(f"File loaded: {file}")
-
-        # Combine all DataFrames
-        combined_df = pd.concat(data_frames, ignore_index=True)
-        logging.info(f"Combined {len(data_frames)} files into a single DataFrame.")
+        # Reuse the Parquet cache when no source CSV has changed since it was written
+        cache_file = cache_path(data_dir, all_files, '.cache_cleaning')
+        if os.path.exists(cache_file):
+            logging.info(f"Loaded cached data: {cache_file}")
+            return pd.read_parquet(cache_file, engine='pyarrow')
+
+        # Read the files concurrently; Arrow's parser releases the GIL while tokenizing
+        with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+            for file, table in zip(all_files, executor.map(read_file, all_files)):
+                # Keep only the column arrays of the file
+                for col in critical_columns:
+                    columns[col].append(table.column(col).to_numpy())
+                del table
+                logging.info("File loaded: %s", file)
+
+        # Concatenate each column once and build the DataFrame in one shot;
+        # popping the per-file chunks frees them as soon as their column is concatenated
+        combined_df = pd.DataFrame({col: np.concatenate(columns.pop(col)) for col in critical_columns}, copy=False)
+        logging.info(f"Combined {len(all_files)} files into a single DataFrame.")
+
+        combined_df.to_parquet(cache_file, engine='pyarrow', compression='zstd')
+        remove_stale_caches(cache_file)
+        logging.info(f"Cached combined data: {cache_file}")
         return combined_df
 
     except Exception as e:
@@ -73,35 +138,46 @@ def clean_data(df):
     Clean the raw stock data.
     - Drop rows with missing critical values.
     - Fill missing numerical values with the mean.
-    - Remove duplicates.
+    - Remove duplicate (Ticker, date) rows, keeping the last one.
     Args:
         df (pd.DataFrame): Raw stock data.
     Returns:
         pd.DataFrame: Cleaned data.
     """
     try:
-        # Check for missing values in critical columns
         critical_columns = ['Ticker', 'DTYYYYMMDD', 'Open', 'High', 'Low', 'Close', 'Volume']
-        missing_critical = df[critical_columns].isnull().sum()
-        logging.info(f"Missing values in critical columns: {missing_critical}")
+
+        # Check for missing values in critical columns; they are only counted for the log,
+        # so skip the pass (and the formatting) when INFO is disabled
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            missing_critical = df[critical_columns].isnull().sum()
+            logging.info("Missing values in critical columns: %s", missing_critical.to_dict())
 
         # Drop rows with missing values in critical columns
         df = df.dropna(subset=critical_columns)
         logging.info("Dropped rows with missing critical values.")
+
+        # Narrow dtypes: float32 prices and a categorical Ticker halve the memory the indicators stream over
+        df = df.astype({
+            'Open': 'float32',
+            'High': 'float32',
+            'Low': 'float32',
+            'Close': 'float32',
+            'Volume': 'int64',
+            'Ticker': 'category'
+        })
         
-        # Fill missing numerical values with the mean
+        # Fill missing numerical values with the mean in one vectorized pass
+        # (the numerical columns are all critical, so nothing is left to fill after the dropna above)
         numerical_cols = ['Open', 'High', 'Low', 'Close', 'Volume']
-        for col in numerical_cols:
-            if col in df.columns:
-                missing_values = df[col].isnull().sum()
-                if missing_values > 0:
-                    mean_value = df[col].mean()
-                    df[col].fillna(mean_value, inplace=True)
-                    logging.info(f"Filled {missing_values} missing values in column '{col}' with mean value: {mean_value}")
+        missing_values = df[numerical_cols].isna().sum()
+        if missing_values.any():
+            df[numerical_cols] = df[numerical_cols].fillna(df[numerical_cols].mean())
+            logging.info("Filled missing values with column means: %s", missing_values[missing_values > 0].to_dict())
         
-        # Remove duplicate rows
+        # Remove duplicate rows; a row is identified by its ticker and date (Ticker hashes by category code)
         initial_row_count = len(df)
-        df = df.drop_duplicates()
+        df = df.drop_duplicates(subset=['Ticker', 'DTYYYYMMDD'], keep='last')
         final_row_count = len(df)
         logging.info(f"Dropped {initial_row_count - final_row_count} duplicate rows.")
 
@@ -121,8 +197,13 @@ if __name__ == "__main__":
         cleaned_data = clean_data(raw_data)
         
         # Save cleaned data
-        output_file = os.path.join(data_dir, "cleaned_stock_data.csv")
-        cleaned_data.to_csv(output_file, index=False)
+        output_file = os.path.join(data_dir, OUTPUT_FILE)
+        # Arrow's multithreaded CSV writer; float32 columns are written in their shortest round-trip form
+        pacsv.write_csv(
+            pa.Table.from_pandas(cleaned_data, preserve_index=False),
+            output_file,
+            write_options=pacsv.WriteOptions(include_header=True)
+        )
         logging.info(f"Data cleaning completed. File saved: '{output_file}'.")
         print("Data cleaning completed. Check 'cleaned_stock_data.csv' and the log file for details.")
     
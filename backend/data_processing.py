@@ -1,6 +1,12 @@
 import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import logging
+from utils import cache_path, njit, remove_stale_caches
 
 # Thiết lập ghi nhật ký
 logging.basicConfig(
@@ -9,6 +15,54 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
+REQUIRED_COLUMNS = ['Ticker', 'DTYYYYMMDD', 'Open', 'High', 'Low', 'Close', 'Volume']
+
+# Kiểu dữ liệu Arrow cho các cột bắt buộc
+COLUMN_TYPES = {
+    'Ticker': pa.string(),
+    'DTYYYYMMDD': pa.int32(),
+    'Open': pa.float32(),
+    'High': pa.float32(),
+    'Low': pa.float32(),
+    'Close': pa.float32(),
+    'Volume': pa.int64(),
+}
+
+def read_file(file):
+    """
+    Read the required columns of one CSV file.
+    Args:
+        file (str): Path to the CSV file.
+    Returns:
+        pa.Table: Arrow table, or None if the file is skipped.
+    """
+    try:
+        # Chỉ đọc các cột bắt buộc, với kiểu dữ liệu cố định (không cần suy luận kiểu);
+        # các tệp đã được đọc song song nên mỗi lần đọc chỉ dùng một luồng
+        table = pacsv.read_csv(
+            file,
+            read_options=pacsv.ReadOptions(use_threads=False),
+            parse_options=pacsv.ParseOptions(delimiter=','),
+            convert_options=pacsv.ConvertOptions(
+                column_types=COLUMN_TYPES,
+                include_columns=REQUIRED_COLUMNS,
+                # Các ô trống (kể cả trong dấu ngoặc kép) là giá trị thiếu, như pd.read_csv
+                strings_can_be_null=True,
+                quoted_strings_can_be_null=True
+            )
+        )
+    except pa.ArrowKeyError as e:
+        # Kiểm tra cột bắt buộc
+        logging.warning("Skipping file %s: Missing required columns (%s).", file, e)
+        return None
+    except Exception as e:
+        logging.error(f"Error loading file {file}: {e}")
+        return None
+    if table.num_rows == 0:
+        logging.warning("Skipping file %s: File is empty.", file)
+        return None
+    return table
+
 def load_data(data_dir):
     """
     Load all CSV files in the data directory and combine into a single DataFrame.
@@ -17,47 +71,179 @@ def load_data(data_dir):
     Returns:
         pd.DataFrame: Combined DataFrame with all stock data.
     """
-    all_files = [os.path.join(data_dir, f) for f in os.listdir(data_dir) if f.endswith('.csv')]
-    data_frames = []
+    with os.scandir(data_dir) as entries:
+        all_files = sorted(e.path for e in entries if e.is_file() and e.name.endswith('.csv'))
+    columns = defaultdict(list)
     
-    for file in all_files:
-        try:
-            df = pd.read_csv(file)
-            # Kiểm tra cột bắt buộc
-            required_columns = {'Ticker', 'DTYYYYMMDD', 'Open', 'High', 'Low', 'Close', 'Volume'}
-            if not required_columns.issubset(df.columns):
-                logging.warning(f"Skipping file {file}: Missing required columns {required_columns - set(df.columns)}.")
-                continue
-            if df.empty:
-                logging.warning(f"Skipping file {file}: File is empty.")
+    # Dùng lại bộ đệm Parquet nếu các tệp CSV nguồn không thay đổi
+    cache_file = cache_path(data_dir, all_files, '.cache_processing')
+    if os.path.exists(cache_file):
+        logging.info(f"Loaded cached data: {cache_file}")
+        return pd.read_parquet(cache_file, engine='pyarrow')
+    
+    # Đọc song song các tệp; trình phân tích CSV của Arrow nhả GIL khi tách token
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+        for file, table in zip(all_files, executor.map(read_file, all_files)):
+            if table is None:
                 continue
-            data_frames.append(df)
-            logging.info(f"Loaded file: {file}")
-        except Exception as e:
-            logging.error(f"Error loading file {file}: {e}")
+            for col in REQUIRED_COLUMNS:
+                columns[col].append(table.column(col).to_numpy())
+            del table
+            logging.info("Loaded file: %s", file)
     
-    if not data_frames:
+    if not columns:
         raise ValueError("No valid CSV files found in the directory.")
     
-    combined_df = pd.concat(data_frames, ignore_index=True)
-    logging.info(f"Combined {len(data_frames)} files into a single DataFrame.")
+    # Nối từng cột một lần rồi tạo DataFrame; các mảng của từng tệp được giải phóng ngay sau khi nối
+    file_count = len(columns['Ticker'])
+    combined_df = pd.DataFrame({col: np.concatenate(columns.pop(col)) for col in REQUIRED_COLUMNS}, copy=False)
+    combined_df['Ticker'] = combined_df['Ticker'].astype('category')
+    logging.info(f"Combined {file_count} files into a single DataFrame.")
+    
+    combined_df.to_parquet(cache_file, engine='pyarrow', compression='zstd')
+    remove_stale_caches(cache_file)
+    logging.info(f"Cached combined data: {cache_file}")
     return combined_df
 
+@njit('UniTuple(float32[:], 2)(float32[:], int64)', cache=True)
+def _rolling_mean_std(close, window):
+    """
+    Rolling mean and sample standard deviation (ddof=1) over a fixed window.
+    Each window is summed directly, which is exact for the short windows used here.
+    Args:
+        close (np.ndarray): Closing prices of a single ticker.
+        window (int): Window length.
+    Returns:
+        tuple: Rolling mean and rolling std arrays, NaN for the first `window - 1` rows.
+    """
+    n = close.shape[0]
+    mean = np.full(n, np.nan, dtype=np.float32)
+    std = np.full(n, np.nan, dtype=np.float32)
+    for i in range(window - 1, n):
+        total = 0.0
+        for j in range(i - window + 1, i + 1):
+            total += close[j]
+        m = total / window
+        sq = 0.0
+        for j in range(i - window + 1, i + 1):
+            sq += (close[j] - m) ** 2
+        mean[i] = m
+        std[i] = np.sqrt(sq / (window - 1))
+    return mean, std
+
+@njit('UniTuple(float64, 2)(float64, float64, float64, float64)', cache=True)
+def _ewm_step(ema, old_weight, value, alpha):
+    """
+    One step of pandas' ewm(adjust=False) mean, including its NaN handling.
+    A NaN value leaves the EMA unchanged but still decays the weight of the history,
+    so the next value is weighted as if the skipped steps had been observed.
+    Args:
+        ema (float): Current EMA, NaN until the first non-NaN value.
+        old_weight (float): Weight of the current EMA relative to a new value.
+        value (float): Next value of the series.
+        alpha (float): Smoothing factor.
+    Returns:
+        tuple: Updated EMA and weight.
+    """
+    if ema == ema:
+        old_weight *= 1 - alpha
+        if value == value:
+            ema = (old_weight * ema + alpha * value) / (old_weight + alpha)
+            old_weight = 1.0
+    elif value == value:
+        ema = value
+    return ema, old_weight
+
+@njit('float32[:](float32[:], float64)', cache=True)
+def _ema_loop(close, alpha):
+    """
+    Exponential moving average, same recurrence and NaN handling as pandas' ewm(adjust=False).
+    Args:
+        close (np.ndarray): Closing prices of a single ticker.
+        alpha (float): Smoothing factor, 2 / (span + 1).
+    Returns:
+        np.ndarray: EMA values.
+    """
+    n = close.shape[0]
+    out = np.empty(n, dtype=np.float32)
+    ema = np.nan
+    weight = 1.0
+    for i in range(n):
+        ema, weight = _ewm_step(ema, weight, close[i], alpha)
+        out[i] = ema
+    return out
+
+@njit('float32[:](float32[:], int64)', cache=True)
+def _rsi_loop(close, window):
+    """
+    Single-pass RSI kernel using Wilder's smoothing of average gain and loss.
+    A price change involving a NaN close counts as neither gain nor loss, as delta.where(...) did.
+    Args:
+        close (np.ndarray): Closing prices of a single ticker.
+        window (int): Lookback period.
+    Returns:
+        np.ndarray: RSI values, NaN for the first `window` rows.
+    """
+    n = close.shape[0]
+    out = np.full(n, np.nan, dtype=np.float32)
+    if n <= window:
+        return out
+    gain = 0.0
+    loss = 0.0
+    for i in range(1, window + 1):
+        d = close[i] - close[i - 1]
+        if d > 0:
+            gain += d
+        elif d < 0:
+            loss -= d
+    gain /= window
+    loss /= window
+    out[window] = 100 - 100 / (1 + gain / loss) if loss > 0 else 100.0
+    for i in range(window + 1, n):
+        d = close[i] - close[i - 1]
+        gain = (gain * (window - 1) + (d if d > 0 else 0.0)) / window
+        loss = (loss * (window - 1) + (-d if d < 0 else 0.0)) / window
+        out[i] = 100 - 100 / (1 + gain / loss) if loss > 0 else 100.0
+    return out
+
 def calculate_rsi(series, window=14):
     """
-    Calculate Relative Strength Index (RSI) for a given series.
+    Calculate Relative Strength Index (RSI) for a given series, using Wilder's smoothing.
     Args:
         series (pd.Series): Series of prices.
         window (int): Lookback period for RSI.
     Returns:
         pd.Series: RSI values.
     """
-    delta = series.diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=window).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=window).mean()
-    rs = gain / loss
-    rsi = 100 - (100 / (1 + rs))
-    return rsi
+    # copy=True: the kernel needs a writable array (see calculate_macd)
+    rsi = _rsi_loop(series.to_numpy(dtype=np.float32, copy=True), window)
+    return pd.Series(rsi, index=series.index)
+
+@njit('UniTuple(float32[:], 2)(float32[:], float64, float64, float64)', cache=True)
+def _macd_loop(close, alpha_short, alpha_long, alpha_signal):
+    """
+    Fused MACD kernel: short EMA, long EMA, MACD and Signal Line in one pass.
+    Matches pandas' ewm(adjust=False), NaN handling included, with alpha = 2 / (span + 1).
+    Args:
+        close (np.ndarray): Closing prices of a single ticker.
+        alpha_short (float): Smoothing factor of the short-term EMA.
+        alpha_long (float): Smoothing factor of the long-term EMA.
+        alpha_signal (float): Smoothing factor of the Signal Line EMA.
+    Returns:
+        tuple: MACD and Signal Line arrays.
+    """
+    n = close.shape[0]
+    macd = np.empty(n, dtype=np.float32)
+    signal_line = np.empty(n, dtype=np.float32)
+    ema_short = ema_long = signal_value = np.nan
+    weight_short = weight_long = weight_signal = 1.0
+    for i in range(n):
+        ema_short, weight_short = _ewm_step(ema_short, weight_short, close[i], alpha_short)
+        ema_long, weight_long = _ewm_step(ema_long, weight_long, close[i], alpha_long)
+        macd[i] = ema_short - ema_long
+        signal_value, weight_signal = _ewm_step(signal_value, weight_signal, macd[i], alpha_signal)
+        signal_line[i] = signal_value
+    return macd, signal_line
 
 def calculate_macd(series, span_short=12, span_long=26, signal=9):
     """
@@ -68,13 +254,66 @@ def calculate_macd(series, span_short=12, span_long=26, signal=9):
         span_long (int): Long-term EMA span.
         signal (int): Signal line EMA span.
     Returns:
-        pd.DataFrame: DataFrame containing MACD and Signal Line.
+        tuple: MACD and Signal Line Series.
     """
-    ema_short = series.ewm(span=span_short, adjust=False).mean()
-    ema_long = series.ewm(span=span_long, adjust=False).mean()
-    macd = ema_short - ema_long
-    signal_line = macd.ewm(span=signal, adjust=False).mean()
-    return macd, signal_line
+    # copy=True: under Copy-on-Write to_numpy returns a read-only view,
+    # which the kernels' writable float32[:] signatures do not accept
+    macd, signal_line = _macd_loop(
+        series.to_numpy(dtype=np.float32, copy=True),
+        2 / (span_short + 1),
+        2 / (span_long + 1),
+        2 / (signal + 1)
+    )
+    return pd.Series(macd, index=series.index), pd.Series(signal_line, index=series.index)
+
+@njit('UniTuple(float32[:], 2)(float32[:], float32[:], float32[:], int64, int64)', cache=True)
+def _stochastic_loop(low, high, close, k_period, d_period):
+    """
+    Stochastic Oscillator kernel.
+    Sliding min/max are tracked with monotonic index deques (one push and at most one pop per element),
+    and %D is averaged in the same pass.
+    Args:
+        low (np.ndarray): Low prices of a single ticker.
+        high (np.ndarray): High prices of a single ticker.
+        close (np.ndarray): Closing prices of a single ticker.
+        k_period (int): Lookback period for %K.
+        d_period (int): Moving average period for %D.
+    Returns:
+        tuple: %K and %D arrays, NaN until their windows are full or when the high-low range is zero.
+    """
+    n = close.shape[0]
+    k_percent = np.full(n, np.nan, dtype=np.float32)
+    d_percent = np.full(n, np.nan, dtype=np.float32)
+    # Deques of row positions, stored in arrays with head/tail pointers
+    min_queue = np.empty(n, dtype=np.int64)
+    max_queue = np.empty(n, dtype=np.int64)
+    min_head = min_tail = 0
+    max_head = max_tail = 0
+    for i in range(n):
+        while min_tail > min_head and low[min_queue[min_tail - 1]] >= low[i]:
+            min_tail -= 1
+        min_queue[min_tail] = i
+        min_tail += 1
+        if min_queue[min_head] <= i - k_period:
+            min_head += 1
+        while max_tail > max_head and high[max_queue[max_tail - 1]] <= high[i]:
+            max_tail -= 1
+        max_queue[max_tail] = i
+        max_tail += 1
+        if max_queue[max_head] <= i - k_period:
+            max_head += 1
+
+        if i >= k_period - 1:
+            low_min = low[min_queue[min_head]]
+            price_range = high[max_queue[max_head]] - low_min
+            if price_range > 0:
+                k_percent[i] = 100 * (close[i] - low_min) / price_range
+        if i >= k_period + d_period - 2:
+            total = 0.0
+            for j in range(i - d_period + 1, i + 1):
+                total += k_percent[j]
+            d_percent[i] = total / d_period
+    return k_percent, d_percent
 
 def calculate_stochastic_oscillator(df, k_period=14, d_period=3):
     """
@@ -84,15 +323,66 @@ def calculate_stochastic_oscillator(df, k_period=14, d_period=3):
         k_period (int): Lookback period for %K.
         d_period (int): Moving average period for %D.
     Returns:
-        pd.DataFrame: DataFrame containing %K and %D.
+        tuple: %K and %D Series.
     """
-    low_min = df['Low'].rolling(window=k_period).min()
-    high_max = df['High'].rolling(window=k_period).max()
-    k_percent = 100 * (df['Close'] - low_min) / (high_max - low_min)
-    d_percent = k_percent.rolling(window=d_period).mean()
-    return k_percent, d_percent
+    k_percent, d_percent = _stochastic_loop(
+        df['Low'].to_numpy(dtype=np.float32, copy=True),
+        df['High'].to_numpy(dtype=np.float32, copy=True),
+        df['Close'].to_numpy(dtype=np.float32, copy=True),
+        k_period,
+        d_period
+    )
+    return pd.Series(k_percent, index=df.index), pd.Series(d_percent, index=df.index)
+
+def parse_yyyymmdd(values):
+    """
+    Convert YYYYMMDD integers to datetimes by integer decomposition instead of string parsing.
+    Args:
+        values (np.ndarray): Dates encoded as YYYYMMDD integers (float with NaN if some are missing).
+    Returns:
+        np.ndarray: datetime64[ns] values, NaT where the date is missing.
+    Raises:
+        ValueError: If a present value is not a valid calendar date.
+    """
+    missing = pd.isna(values)
+    # Missing dates are parsed as a valid placeholder and set to NaT at the end
+    year, month_day = np.divmod(np.where(missing, 19700101, values).astype(np.int64), 10000)
+    month, day = np.divmod(month_day, 100)
+    months = (year - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (month - 1)
+    dates = months.astype('datetime64[D]') + (day - 1)
+    # Out-of-range months or days would silently roll over into the next month, and dates
+    # outside the datetime64[ns] range would wrap around in the cast below
+    invalid = (
+        (month < 1) | (month > 12) | (day < 1)
+        | (dates.astype('datetime64[M]') != months)
+        | (dates < np.datetime64(pd.Timestamp.min.ceil('D'), 'D'))
+        | (dates > np.datetime64(pd.Timestamp.max.floor('D'), 'D'))
+    )
+    if invalid.any():
+        raise ValueError("DTYYYYMMDD contains values that are not valid YYYYMMDD dates.")
+    dates = dates.astype('datetime64[ns]')
+    dates[missing] = np.datetime64('NaT')
+    return dates
 
-def preprocess_data(df):
+def _per_ticker(close, high, low):
+    """
+    Compute the price-based indicators of a single ticker.
+    Runs in a worker process, so it only takes and returns numpy arrays.
+    Args:
+        close (np.ndarray): float32 closing prices of one ticker, in date order.
+        high (np.ndarray): float32 high prices of the same rows.
+        low (np.ndarray): float32 low prices of the same rows.
+    Returns:
+        tuple: SMA_10, EMA_10, 10-day rolling std, RSI_14, MACD, Signal Line, %K and %D arrays.
+    """
+    sma_10, std_10 = _rolling_mean_std(close, 10)
+    ema_10 = _ema_loop(close, 2 / (10 + 1))
+    rsi_14 = _rsi_loop(close, 14)
+    macd, signal_line = _macd_loop(close, 2 / (12 + 1), 2 / (26 + 1), 2 / (9 + 1))
+    k_percent, d_percent = _stochastic_loop(low, high, close, 14, 3)
+    return sma_10, ema_10, std_10, rsi_14, macd, signal_line, k_percent, d_percent
+
+def preprocess_data(df, max_workers=None):
     """
     Preprocess the stock data.
     - Convert date to datetime.
@@ -100,39 +390,68 @@ def preprocess_data(df):
     - Add technical indicators (e.g., SMA, EMA, Bollinger Bands, RSI, MACD, Stochastic Oscillator).
     Args:
         df (pd.DataFrame): Raw stock data.
+        max_workers (int, optional): Number of worker processes for the per-ticker indicators.
+            Defaults to the number of CPUs.
     Returns:
         pd.DataFrame: Preprocessed data with additional features.
     """
     try:
-        # Convert date column to datetime
-        df['Date'] = pd.to_datetime(df['DTYYYYMMDD'], format='%Y%m%d')
-        df = df.drop(columns=['DTYYYYMMDD'])
+        # Convert date column to datetime; assign() returns a new frame, so the caller's
+        # DataFrame (possibly a slice of another one) is never written to
+        df = df.assign(Date=parse_yyyymmdd(df['DTYYYYMMDD'].to_numpy())).drop(columns=['DTYYYYMMDD'])
         logging.info("Converted 'DTYYYYMMDD' to datetime and dropped the column.")
         
         # Sort data by Ticker and Date
         df = df.sort_values(by=['Ticker', 'Date'])
         logging.info("Sorted data by 'Ticker' and 'Date'.")
         
+        grouped = df.groupby('Ticker', sort=False, observed=True)
+        groups = grouped.indices
+        
+        # Tickers are independent, so compute the indicators of each one in parallel
+        # and scatter the results back into full-length arrays by row position
+        close_values = df['Close'].to_numpy(dtype=np.float32)
+        high_values = df['High'].to_numpy(dtype=np.float32)
+        low_values = df['Low'].to_numpy(dtype=np.float32)
+        # Rows with a null Ticker belong to no group and keep NaN, as transform() gave them
+        sma_10, ema_10, std_10, rsi_14, macd, signal_line, k_percent, d_percent = (
+            np.full(len(df), np.nan, dtype=np.float32) for _ in range(8)
+        )
+        chunksize = max(1, len(groups) // (4 * (max_workers or os.cpu_count() or 1)))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = executor.map(
+                _per_ticker,
+                [close_values[idx] for idx in groups.values()],
+                [high_values[idx] for idx in groups.values()],
+                [low_values[idx] for idx in groups.values()],
+                chunksize=chunksize
+            )
+            for idx, result in zip(groups.values(), results):
+                (sma_10[idx], ema_10[idx], std_10[idx], rsi_14[idx],
+                 macd[idx], signal_line[idx], k_percent[idx], d_percent[idx]) = result
+        
         # Add moving averages
-        df['SMA_10'] = df.groupby('Ticker')['Close'].transform(lambda x: x.rolling(window=10).mean())
-        df['EMA_10'] = df.groupby('Ticker')['Close'].transform(lambda x: x.ewm(span=10, adjust=False).mean())
+        df['SMA_10'] = sma_10
+        df['EMA_10'] = ema_10
         
         # Add Bollinger Bands
-        df['BB_Middle'] = df['SMA_10']
-        df['BB_Upper'] = df['BB_Middle'] + 2 * df.groupby('Ticker')['Close'].transform(lambda x: x.rolling(window=10).std())
-        df['BB_Lower'] = df['BB_Middle'] - 2 * df.groupby('Ticker')['Close'].transform(lambda x: x.rolling(window=10).std())
+        df['BB_Middle'] = sma_10
+        df['BB_Upper'] = sma_10 + 2 * std_10
+        df['BB_Lower'] = sma_10 - 2 * std_10
         
         # Add daily return
-        df['Daily_Return'] = df.groupby('Ticker')['Close'].pct_change()
+        df['Daily_Return'] = grouped['Close'].pct_change()
         
         # Add RSI
-        df['RSI_14'] = df.groupby('Ticker')['Close'].transform(lambda x: calculate_rsi(x, window=14))
+        df['RSI_14'] = rsi_14
         
         # Add MACD
-        df['MACD'], df['Signal_Line'] = zip(*df.groupby('Ticker')['Close'].apply(lambda x: calculate_macd(x)))
+        df['MACD'] = macd
+        df['Signal_Line'] = signal_line
         
         # Add Stochastic Oscillator
-        df['%K'], df['%D'] = zip(*df.groupby('Ticker').apply(lambda group: calculate_stochastic_oscillator(group)))
+        df['%K'] = k_percent
+        df['%D'] = d_percent
         
         logging.info("Added technical indicators: SMA, EMA, Bollinger Bands, Daily Return, RSI, MACD, Stochastic Oscillator.")
         
@@ -151,10 +470,10 @@ if __name__ == "__main__":
         processed_data = preprocess_data(raw_data)
         
         # Save the processed data
-        output_file = os.path.join(data_dir, "processed_stock_data.csv")
-        processed_data.to_csv(output_file, index=False)
+        output_file = os.path.join(data_dir, "processed_stock_data.parquet")
+        processed_data.to_parquet(output_file, engine='pyarrow', compression='zstd', index=False)
         logging.info(f"Data processing complete. Processed file saved as '{output_file}'.")
-        print("Data processing complete. Check 'processed_stock_data.csv' and logs for details.")
+        print("Data processing complete. Check 'processed_stock_data.parquet' and logs for details.")
     except Exception as e:
         logging.critical(f"Failed to process data: {e}")
         print(f"Error: {e}")
@@ -0,0 +1,2 @@
+from ._cache import cache_path, remove_stale_caches
+from ._njit import njit
@@ -0,0 +1,32 @@
+import glob
+import hashlib
+import os
+
+
+def cache_path(data_dir, files, prefix):
+    """
+    Path of the Parquet cache for a set of source files.
+    The key changes whenever a file is added, removed, modified or resized.
+    Args:
+        data_dir (str): Directory the cache file is stored in.
+        files (list): Paths of the source files.
+        prefix (str): File name prefix, so different loaders don't share a cache.
+    Returns:
+        str: Path of the cache file.
+    """
+    stats = sorted((f, os.path.getmtime(f), os.path.getsize(f)) for f in files)
+    # hashlib rather than hash(): str hashes are salted per process, so they would never hit
+    key = hashlib.md5(repr(stats).encode()).hexdigest()
+    return os.path.join(data_dir, f"{prefix}_{key}.parquet")
+
+
+def remove_stale_caches(path):
+    """
+    Delete the other cache files sharing the prefix of `path`.
+    Args:
+        path (str): Path of the cache file to keep.
+    """
+    prefix = path.rsplit('_', 1)[0]
+    for stale in glob.glob(f"{glob.escape(prefix)}_*.parquet"):
+        if stale != path:
+            os.remove(stale)
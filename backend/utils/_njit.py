@@ -0,0 +1,15 @@
+# numba is optional: without it the kernels decorated with njit run as plain Python
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        """
+        No-op stand-in for numba.njit.
+        Supports both the bare (@njit) and the parametrized (@njit(cache=True)) forms.
+        """
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+
+        def decorator(func):
+            return func
+        return decorator